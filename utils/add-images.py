@@ -11,13 +11,16 @@ Output:
 
 import sys
 import time
-import random
+import asyncio
 import csv
+import io
+import sqlite3
+from email.utils import parsedate_to_datetime
+from itertools import islice
 from pathlib import Path
 from typing import Optional
 
-import requests
-from bs4 import BeautifulSoup
+import aiohttp
 
 # Optional: use tqdm if available for a nice progress bar
 try:
@@ -32,51 +35,178 @@ HEADERS = {
     "Referer": "https://myanimelist.net/",
 }
 
+# Jikan allows roughly 3 requests per second: request starts are spaced
+# REQUEST_PAUSE apart across all workers, and at most MAX_CONCURRENCY are in flight
+MAX_CONCURRENCY = 3
+BATCH_SIZE = 5
+REQUEST_PAUSE = 0.34  # minimum seconds between request starts
+
+# Retry policy for rate limiting / server errors / network failures
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 1.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Persistent MAL_ID -> image URL cache shared across runs and input files
+CACHE_FILE = "mal_image_cache.db"
+CACHE_TTL = 30 * 24 * 3600  # seconds before a cached URL is refetched
+
 
 def get_image_url_from_html(html: str) -> Optional[str]:
     """Parse HTML and return the best guess for cover image URL or None."""
-    soup = BeautifulSoup(html, "html.parser")
+    # Imported here so the Jikan path doesn't depend on selectolax
+    from selectolax.lexbor import LexborHTMLParser
+
+    tree = LexborHTMLParser(html)
 
     # 1) Prefer the Open Graph image
-    og = soup.find("meta", property="og:image")
-    if og and og.get("content"):
-        return og["content"].strip()
+    og = tree.css_first('meta[property="og:image"]')
+    if og and og.attributes.get("content"):
+        return og.attributes["content"].strip()
 
     # 2) Look for <img itemprop="image"> or <img ... src=...>
-    img = soup.find("img", attrs={"itemprop": "image"})
-    if img and img.get("data-src"):
-        return img["data-src"].strip()
-    if img and img.get("src"):
-        return img["src"].strip()
+    img = tree.css_first('img[itemprop="image"]')
+    if img and img.attributes.get("data-src"):
+        return img.attributes["data-src"].strip()
+    if img and img.attributes.get("src"):
+        return img.attributes["src"].strip()
 
     # 3) fallback: first image inside #content or .leftside, etc.
     # (MAL layout may change; this is a best-effort fallback)
     for selector in ["#content img", ".leftside img", ".pic img"]:
-        el = soup.select_one(selector)
-        if el and el.get("src"):
-            return el["src"].strip()
+        el = tree.css_first(selector)
+        if el and el.attributes.get("src"):
+            return el.attributes["src"].strip()
 
     return None
 
 
-def fetch_image_url(mal_id, session=None):
+class RateLimiter:
+    """Space request starts at least `interval` seconds apart across all workers."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    async def wait(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next_start > now:
+                await asyncio.sleep(self._next_start - now)
+                now = self._next_start
+            self._next_start = now + self.interval
+
+    def defer(self, delay: float):
+        """Hold back every worker's next request by at least `delay` seconds."""
+        now = asyncio.get_running_loop().time()
+        self._next_start = max(self._next_start, now + delay)
+
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+async def fetch_image_url(session, mal_id, sem, limiter):
     if not mal_id:
         return None
 
-    try:
-        url = f"https://api.jikan.moe/v4/anime/{mal_id}"
-        r = requests.get(url, timeout=10)
+    url = f"https://api.jikan.moe/v4/anime/{mal_id}"
+    async with sem:
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                last_attempt = attempt == MAX_RETRIES
+                await limiter.wait()
+                try:
+                    async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as r:
+                        if r.status == 200:
+                            try:
+                                data = await r.json()
+                            except (aiohttp.ContentTypeError, ValueError) as e:
+                                # a non-JSON body won't get better on retry
+                                print(f"Bad response for {mal_id}:", e)
+                                return None
+                            return data["data"]["images"]["jpg"]["image_url"]
+
+                        if r.status not in RETRY_STATUSES or last_attempt:
+                            return None
+
+                        retry_after = retry_after_seconds(r.headers.get("Retry-After"))
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if last_attempt:
+                        raise
+                    print(f"Retrying {mal_id} after {type(e).__name__}: {e}")
+                    retry_after = None
+
+                # the server's Retry-After applies to everyone; otherwise back off
+                # exponentially on rate limiting / server errors / network failures
+                if retry_after is not None:
+                    limiter.defer(retry_after)
+                else:
+                    await asyncio.sleep(BACKOFF_FACTOR * (2 ** attempt))
 
-        if r.status_code != 200:
+        except Exception as e:
+            print("Error:", e)
             return None
 
-        data = r.json()
 
-        return data["data"]["images"]["jpg"]["image_url"]
+def open_cache(path: Path) -> sqlite3.Connection:
+    """Open (creating if needed) the on-disk image URL cache."""
+    cache = sqlite3.connect(str(path))
+    cache.execute("""
+    CREATE TABLE IF NOT EXISTS images (
+        mal_id INTEGER PRIMARY KEY,
+        url TEXT,
+        fetched_at INTEGER
+    )
+    """)
+    return cache
+
+
+def cache_get(cache: sqlite3.Connection, mal_id: str) -> Optional[str]:
+    row = cache.execute(
+        "SELECT url, fetched_at FROM images WHERE mal_id = ?", (mal_id,)
+    ).fetchone()
+    if row and time.time() - row[1] < CACHE_TTL:
+        return row[0]
+    return None
 
-    except Exception as e:
-        print("Error:", e)
-        return None
+
+def cache_put(cache: sqlite3.Connection, mal_id: str, url: str):
+    cache.execute(
+        "INSERT OR REPLACE INTO images (mal_id, url, fetched_at) VALUES (?, ?, ?)",
+        (mal_id, url, int(time.time())),
+    )
+
+
+async def resolve_image(session, row, already_done, cache, sem, limiter):
+    """Return the image URL for a row, reusing a previously fetched value if any."""
+    mal_id = str(row.get("MAL_ID", "")).strip()
+
+    # If we already have this MAL_ID in existing out file, reuse it
+    image_url = already_done.get(mal_id)
+    if image_url:
+        return image_url
+
+    # Then try the persistent cache before going to the network
+    if mal_id:
+        image_url = cache_get(cache, mal_id)
+    if not image_url:
+        image_url = await fetch_image_url(session, mal_id, sem, limiter)
+        if image_url:
+            cache_put(cache, mal_id, image_url)
+    return image_url
 
 
 def insert_column_after(headers: list, after_col: str, new_col: str) -> list:
@@ -88,7 +218,7 @@ def insert_column_after(headers: list, after_col: str, new_col: str) -> list:
     return headers[: idx + 1] + [new_col] + headers[idx + 1 :]
 
 
-def main(infile: str):
+async def main_async(infile: str):
     in_path = Path(infile)
     if not in_path.exists():
         print("Input file not found:", infile)
@@ -105,6 +235,9 @@ def main(infile: str):
             print("Input CSV is empty")
             return
 
+        # Cheap record count for the progress bar (CSV fields may span lines)
+        total = sum(1 for _ in reader)
+
     # Prepare output headers with 'image' inserted after 'MAL_ID'
     out_headers = insert_column_after(headers, "MAL_ID", "image")
 
@@ -120,53 +253,59 @@ def main(infile: str):
                 if mid:
                     already_done[mid] = row.get("image")
 
-    session = requests.Session()
-
     rows_processed = 0
-    save_every = 50  # flush to disk every N rows
+    report_every = 50  # print progress every N rows
 
     # We'll read input rows and write to a temp file, and replace final on completion.
     temp_path = out_path.with_suffix(out_path.suffix + ".tmp")
 
-    with in_path.open("r", encoding="utf-8-sig", newline="") as f_in, temp_path.open("w", encoding="utf-8", newline="") as f_out:
-        reader = csv.DictReader(f_in)
-        writer = csv.DictWriter(f_out, fieldnames=out_headers, extrasaction="ignore")
-        writer.writeheader()
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    limiter = RateLimiter(REQUEST_PAUSE)
+    cache = open_cache(in_path.with_name(CACHE_FILE))
 
-        for row in tqdm(list(reader), desc="Rows", unit="row"):
-            rows_processed += 1
-            mal_id = str(row.get("MAL_ID", "")).strip()
+    # One pooled session for the whole run so connections (and TLS) are reused
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY)
+    async with aiohttp.ClientSession(headers=HEADERS, connector=connector) as session:
+        # Large write buffer; crash safety comes from the final atomic replace
+        raw_out = temp_path.open("wb", buffering=1 << 20)
+        with in_path.open("r", encoding="utf-8-sig", newline="") as f_in, io.TextIOWrapper(raw_out, encoding="utf-8", newline="", write_through=False) as f_out:
+            reader = csv.DictReader(f_in)
+            writer = csv.DictWriter(f_out, fieldnames=out_headers, extrasaction="ignore")
+            writer.writeheader()
 
-            # If we already have this MAL_ID in existing out file, reuse it
-            image_url = None
-            if mal_id in already_done:
-                image_url = already_done[mal_id]
+            rows = iter(tqdm(reader, total=total, desc="Rows", unit="row"))
+            while True:
+                batch = list(islice(rows, BATCH_SIZE))
+                if not batch:
+                    break
 
-            if not image_url:
-                image_url = fetch_image_url(mal_id, session)
+                # fetch the whole batch concurrently, results keep row order
+                image_urls = await asyncio.gather(
+                    *[resolve_image(session, row, already_done, cache, sem, limiter) for row in batch]
+                )
+                cache.commit()
 
-                # polite pause to avoid hammering the site
-                time.sleep(random.uniform(1.0, 1.6))
+                for row, image_url in zip(batch, image_urls):
+                    rows_processed += 1
 
-            # attach image to row
-            new_row = {}
-            for col in out_headers:
-                if col == "image":
-                    new_row["image"] = image_url or ""
-                else:
-                    new_row[col] = row.get(col, "")
+                    # attach image to row; DictWriter picks out_headers by name
+                    row["image"] = image_url or ""
+                    writer.writerow(row)
 
-            writer.writerow(new_row)
+                    if rows_processed % report_every == 0:
+                        print(f"Progress: {rows_processed} rows")
 
-            if rows_processed % save_every == 0:
-                f_out.flush()
-                print(f"Saved progress: {rows_processed} rows")
+    cache.close()
 
     # replace final output
     temp_path.replace(out_path)
     print(f"All done. Output saved to: {out_path}")
 
 
+def main(infile: str):
+    asyncio.run(main_async(infile))
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python add_images_to_csv.py input.csv")
@@ -10,18 +10,39 @@ Features:
 - Skips Demographic, Popularity, and Source columns.
 - Always inserts genres into Genres and links via AnimeGenres.
 - Robust parsing of genre lists.
+- CSV rows are parsed in worker processes; a single writer loads SQLite.
 """
 
 import sqlite3
 import csv
 import ast
+import json
+import math
+import os
 import re
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Union
+
+# Optional: use pyarrow's C++ CSV reader if available
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+except Exception:
+    pa = pc = pacsv = None
 
 csv.field_size_limit(sys.maxsize)
 
+_GENRE_RE = re.compile(r"[A-Za-z0-9\s\-]+")
+_INT_RE = re.compile(r"\d+")
+
+# Columns pyarrow converts to float64 in bulk while reading
+NUMERIC_COLUMNS = {"score", "rating", "episodes", "eps"}
+
 
 # ---------- Parsing helpers ----------
 
@@ -42,7 +63,6 @@ def parse_genres(raw: str) -> List[str]:
     s_json = s.replace("'", '"')
 
     # Try parsing as JSON array
-    import json
     try:
         val = json.loads(s_json)
         if isinstance(val, list):
@@ -50,23 +70,35 @@ def parse_genres(raw: str) -> List[str]:
     except:
         pass
 
+    # Python list literal the JSON rewrite can't handle (e.g. "Girls' Love")
+    try:
+        val = ast.literal_eval(s)
+        if isinstance(val, (list, tuple)):
+            return [str(x).strip() for x in val if str(x).strip()]
+    except Exception:
+        pass
+
     # Fallback: regex to capture words
-    found = re.findall(r"[A-Za-z0-9\s\-]+", s)
+    found = _GENRE_RE.findall(s)
     return [f.strip() for f in found if f.strip()]
 
 
 
-def parse_episodes(raw: str) -> Optional[int]:
+def parse_episodes(raw: Union[str, float, None]) -> Optional[int]:
+    if isinstance(raw, float):  # already converted by the pyarrow reader
+        return int(raw) if math.isfinite(raw) else None
     if not raw:
         return None
     try:
         return int(float(raw))
     except:
-        m = re.search(r"\d+", str(raw))
+        m = _INT_RE.search(str(raw))
         return int(m.group()) if m else None
 
 
-def parse_score(raw: str) -> Optional[float]:
+def parse_score(raw: Union[str, float, None]) -> Optional[float]:
+    if isinstance(raw, float):  # already converted by the pyarrow reader
+        return raw
     if not raw:
         return None
     try:
@@ -75,12 +107,143 @@ def parse_score(raw: str) -> Optional[float]:
         return None
 
 
+# ---------- Chunk parsing (worker processes) ----------
+
+PARSE_CHUNK_ROWS = 5000
+
+# SQLite INTEGER is a signed 64-bit value
+SQLITE_INT_MIN = -(2 ** 63)
+SQLITE_INT_MAX = 2 ** 63 - 1
+
+
+def field(row, idx: Optional[int]) -> str:
+    if idx is None or idx >= len(row):
+        return ""
+    return row[idx]
+
+
+def check_sqlite_int(value: Optional[int]):
+    """Reject ints SQLite can't store, before they reach a batched insert."""
+    if value is not None and not SQLITE_INT_MIN <= value <= SQLITE_INT_MAX:
+        raise OverflowError("Python int too large to convert to SQLite INTEGER")
+
+
+def parse_chunk(chunk, cols):
+    """Parse a (start_row, rows) chunk into (anime_fields, genres) tuples.
+
+    `cols` holds the resolved column indices in the order
+    mal_id, image, title, release, synopsis, score, episodes, studio, theme, genre.
+    """
+    start, rows = chunk
+    (mal_id_i, image_i, title_i, release_i, synopsis_i,
+     score_i, episodes_i, studio_i, theme_i, genre_i) = cols
+
+    parsed = []
+    for i, row in enumerate(rows, start=start):
+        raw_mid = field(row, mal_id_i).strip()
+        if not raw_mid:
+            continue
+
+        try:
+            mal_id = int(float(raw_mid))
+        except:
+            continue
+
+        try:
+            check_sqlite_int(mal_id)
+            episodes = parse_episodes(field(row, episodes_i))
+            check_sqlite_int(episodes)
+
+            anime_fields = (
+                mal_id,
+                field(row, image_i),
+                field(row, title_i),
+                field(row, release_i),
+                field(row, synopsis_i),
+                parse_score(field(row, score_i)),
+                episodes,
+                field(row, studio_i),
+                field(row, theme_i),
+            )
+            parsed.append((anime_fields, parse_genres(field(row, genre_i))))
+
+        except Exception as e:
+            print(f"Row {i} skipped:", e)
+
+    return parsed
+
+
+def iter_chunks(rows, size: int):
+    """Yield (start_row, rows) slices of a row iterator."""
+    rows = iter(rows)
+    start = 1
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+def parse_chunks(chunks, cols, workers: int):
+    """Yield parse_chunk results in order, keeping at most 2*workers chunks in flight."""
+    if workers <= 1:
+        # a process pool only adds pickling overhead on a single CPU
+        for chunk in chunks:
+            yield parse_chunk(chunk, cols)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(ex.submit(parse_chunk, chunk, cols))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_rows(csv_path: Path, f):
+    """Return (headers, rows) for the CSV, reading it with pyarrow when installed."""
+    reader = csv.reader(f)
+    headers = next(reader, [])
+    if pacsv is None or not headers:
+        return headers, reader
+
+    # Read everything as text first: an ArrowInvalid here is a structural
+    # problem (e.g. ragged rows that csv.reader and field() tolerate).
+    try:
+        table = pacsv.read_csv(
+            str(csv_path),
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(
+                column_types={h: pa.string() for h in headers},
+            ),
+        )
+    except pa.ArrowInvalid as e:
+        print("pyarrow could not read the CSV, using csv module:", e)
+        return headers, reader
+
+    # Numeric columns are converted by Arrow in C++. A column holding junk
+    # stays text and the parse helpers deal with it row by row.
+    for i, name in enumerate(table.column_names):
+        if name.strip().lower() not in NUMERIC_COLUMNS:
+            continue
+        column = table.column(i)
+        try:
+            empty_as_null = pc.if_else(pc.equal(column, ""), pa.scalar(None, pa.string()), column)
+            table = table.set_column(i, name, pc.cast(empty_as_null, pa.float64()))
+        except pa.ArrowInvalid:
+            pass
+
+    columns = [column.to_pylist() for column in table.columns]
+    return headers, zip(*columns)
+
+
 # ---------- Schema ----------
 
 def create_schema(cur):
     cur.executescript("""
-    PRAGMA foreign_keys = ON;
-
     DROP TABLE IF EXISTS AnimeGenres;
     DROP TABLE IF EXISTS Genres;
     DROP TABLE IF EXISTS Anime;
@@ -110,6 +273,8 @@ def create_schema(cur):
         FOREIGN KEY (anime_id) REFERENCES Anime(id),
         FOREIGN KEY (genre_id) REFERENCES Genres(genre_id)
     );
+
+    CREATE INDEX idx_anime_mal ON Anime(mal_id);
     """)
 
 
@@ -119,91 +284,136 @@ def import_csv_to_db(csv_path: Path, db_path: Path):
     print("CSV:", csv_path)
     print("DB :", db_path)
 
-    conn = sqlite3.connect(str(db_path))
+    # Build into a temp file and replace the real DB only on success, so a
+    # failed import never leaves an emptied database behind.
+    temp_path = db_path.with_suffix(db_path.suffix + ".tmp")
+    temp_path.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(str(temp_path))
     cur = conn.cursor()
-    create_schema(cur)
-    conn.commit()
+
+    # Throwaway bulk-build DB: trade durability for speed while loading.
+    # Foreign keys stay off until the load is done and are checked at the end.
+    cur.executescript("""
+    PRAGMA journal_mode = MEMORY;
+    PRAGMA synchronous = OFF;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -200000;
+    PRAGMA locking_mode = EXCLUSIVE;
+    PRAGMA foreign_keys = OFF;
+    """)
 
     insert_anime_sql = """
     INSERT INTO Anime
-    (mal_id, image, title, release_date, synopsis, score, episodes, studio, theme)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    (id, mal_id, image, title, release_date, synopsis, score, episodes, studio, theme)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """
 
-    insert_genre_sql = "INSERT OR IGNORE INTO Genres (name) VALUES (?)"
-    select_genre_sql = "SELECT genre_id FROM Genres WHERE name = ?"
+    # upsert so an existing name hands back its id in the same round-trip
+    # (RETURNING needs SQLite 3.35+)
+    insert_genre_sql = """
+    INSERT INTO Genres (name) VALUES (?)
+    ON CONFLICT(name) DO UPDATE SET name = name
+    RETURNING genre_id
+    """
     insert_link_sql = "INSERT OR IGNORE INTO AnimeGenres (anime_id, genre_id) VALUES (?, ?)"
 
     inserted = 0
+    chunk_size = 10000
+
+    # Buffered rows, flushed with executemany. Anime ids are assigned here
+    # so genre links can be built without waiting on lastrowid.
+    anime_rows = []
+    genre_link_rows = []
+
+    # genre name -> genre_id, so each genre is inserted exactly once
+    genre_cache = {}
+
+    def flush():
+        cur.executemany(insert_anime_sql, anime_rows)
+        cur.executemany(insert_link_sql, genre_link_rows)
+        anime_rows.clear()
+        genre_link_rows.clear()
+        print("Inserted", inserted)
 
     with csv_path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
+        raw_headers, rows = read_rows(csv_path, f)
 
-        # normalize headers
-        field_map = {h.strip().lower(): h for h in reader.fieldnames if h}
+        create_schema(cur)
+        conn.commit()
+
+        # normalize headers and resolve each wanted column to an index once
+        headers = [h.strip().lower() for h in raw_headers]
+        header_idx = {h: idx for idx, h in enumerate(headers) if h}
 
         print("\nDetected CSV columns:")
-        for k in field_map:
+        for k in header_idx:
             print(" -", k)
 
-        def g(row, *possible_keys):
+        def col(*possible_keys):
             for key in possible_keys:
-                k = field_map.get(key.lower())
-                if k:
-                    return (row.get(k) or "")
-            return ""
-
-        for i, row in enumerate(reader, start=1):
-            raw_mid = g(row, "mal_id", "mal id", "id").strip()
-            if not raw_mid:
-                continue
-
-            try:
-                mal_id = int(float(raw_mid))
-            except:
-                continue
-
-            try:
-                # Insert Anime
-                cur.execute(insert_anime_sql, (
-                    mal_id,
-                    g(row, "image"),
-                    g(row, "title", "name"),
-                    g(row, "release", "release_date", "aired"),
-                    g(row, "synopsis", "description"),
-                    parse_score(g(row, "score", "rating")),
-                    parse_episodes(g(row, "episodes", "eps")),
-                    g(row, "studio", "studios"),
-                    g(row, "theme", "themes"),
-                ))
-
-                anime_id = cur.lastrowid
-
-                # ---------- GENRES ----------
-                raw_genre = g(row, "genre", "genres")
-                genres_list = parse_genres(raw_genre)
-                for genre in genres_list:
-                    cur.execute(insert_genre_sql, (genre,))
-                    cur.execute(select_genre_sql, (genre,))
-                    gid = cur.fetchone()
-                    if gid:
-                        cur.execute(insert_link_sql, (anime_id, gid[0]))
-
-                inserted += 1
-
-                if inserted % 500 == 0:
-                    conn.commit()
-                    print("Inserted", inserted)
-
-            except Exception as e:
-                print(f"Row {i} skipped:", e)
-
-    conn.commit()
+                idx = header_idx.get(key.lower())
+                if idx is not None:
+                    return idx
+            return None
+
+        # same order parse_chunk unpacks them in
+        cols = (
+            col("mal_id", "mal id", "id"),
+            col("image"),
+            col("title", "name"),
+            col("release", "release_date", "aired"),
+            col("synopsis", "description"),
+            col("score", "rating"),
+            col("episodes", "eps"),
+            col("studio", "studios"),
+            col("theme", "themes"),
+            col("genre", "genres"),
+        )
+
+        # Parse in worker processes; this process stays the only SQLite writer.
+        # The whole load runs as a single transaction, committed by `with conn`.
+        with conn:
+            chunks = iter_chunks(rows, PARSE_CHUNK_ROWS)
+            for parsed in parse_chunks(chunks, cols, os.cpu_count() or 1):
+                for anime_fields, genres_list in parsed:
+                    anime_id = inserted + 1
+
+                    # ---------- GENRES ----------
+                    for genre in genres_list:
+                        gid = genre_cache.get(genre)
+                        if gid is None:
+                            cur.execute(insert_genre_sql, (genre,))
+                            gid = cur.fetchone()[0]
+                            genre_cache[genre] = gid
+                        genre_link_rows.append((anime_id, gid))
+
+                    anime_rows.append((anime_id,) + anime_fields)
+                    inserted += 1
+
+                    if len(anime_rows) >= chunk_size:
+                        flush()
+
+            flush()
+
+    # foreign keys were off during the load, so verify them now
+    violations = cur.execute("PRAGMA foreign_key_check").fetchall()
+    if violations:
+        print("\nForeign key violations:", len(violations))
+        for table, rowid, parent, _ in violations[:20]:
+            print(f" - {table} rowid {rowid} -> missing {parent} row")
+        print(f"Import aborted; {db_path} left unchanged.")
+        conn.close()
+        return
+
     cur.execute("SELECT COUNT(*) FROM Anime")
     print("\n✅ Import complete")
     print("Rows in Anime:", cur.fetchone()[0])
     conn.close()
 
+    # replace final output
+    temp_path.replace(db_path)
+
 
 # ---------- Main ----------
 